@@ -6,14 +6,32 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+from plotly.subplots import make_subplots
 import numpy as np
 import io
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import re
+import hashlib
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 from PIL import Image
 from datetime import datetime
 import os
 
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
 # =============================
 # 🌗 Theme Toggle
 # =============================
@@ -100,93 +118,226 @@ st.sidebar.markdown("---")
 # =============================
 # 📦 Data Preprocessing
 # =============================
+@st.cache_data
+def load_df(file_bytes: bytes, name: str) -> pd.DataFrame:
+    """Read the uploaded CSV/Excel once per unique file content."""
+    buffer = io.BytesIO(file_bytes)
+    if name.endswith(".csv"):
+        return pd.read_csv(buffer, engine='pyarrow')
+    try:
+        return pd.read_excel(buffer, engine='calamine')
+    except ImportError:
+        # python-calamine not installed: fall back to the default engine.
+        buffer.seek(0)
+        return pd.read_excel(buffer)
+
+
+# Matches 'HH:MM AM/PM' times; parsed numerically instead of via pd.to_datetime.
+_TIME_PAT = re.compile(r'(\d{1,2}):(\d{2})\s*([AP])M?', re.I)
+
+
+def _minutes_since_midnight(col: pd.Series) -> np.ndarray:
+    """Parse a column of 'HH:MM AM/PM' strings to minutes (NaN where invalid)."""
+    parts = col.astype(str).str.extract(_TIME_PAT)
+    hour = pd.to_numeric(parts[0], errors='coerce').to_numpy()
+    minute = pd.to_numeric(parts[1], errors='coerce').to_numpy()
+    pm = parts[2].str.upper().eq('P').to_numpy()
+    return (hour % 12) * 60 + minute + pm * 720
+
+
+@st.cache_data
+def preprocess(df: pd.DataFrame):
+    """Compute hours from In/Out columns and resolve duplicate rows."""
+    df = df.copy()
+
+    # --- Calculate hours from In/Out columns ---
+    in_cols = [col for col in df.columns if col.startswith('in_')]
+    out_cols = [col for col in df.columns if col.startswith('out_')]
+
+    # Times like '9:00 AM' repeat across employees and days, so parse each
+    # distinct string once and map the results back.
+    all_times = pd.unique(pd.concat([df[c] for c in in_cols + out_cols]).dropna())
+    lookup = dict(zip(all_times, _minutes_since_midnight(pd.Series(all_times))))
+
+    ins = df[in_cols].stack().map(lookup).unstack().reindex(columns=in_cols).to_numpy()
+    outs = df[out_cols].stack().map(lookup).unstack().reindex(columns=out_cols).to_numpy()
+    hours = np.round((outs - ins) / 60.0, 2).astype(np.float32)
+    hours_df = pd.DataFrame(
+        hours,
+        columns=[c.replace('in_', 'hours_') for c in in_cols],
+        index=df.index
+    )
+    df = pd.concat([df, hours_df], axis=1)
+
+    # --- Handle Duplicates ---
+    df = df.drop_duplicates()
+    duplicates = df[df['employee_id'].duplicated(keep=False)]
+
+    # Keep the row with the most hours per employee: one idxmax per group
+    # instead of sorting the whole frame by total hours. Only the kept rows
+    # are then ordered by descending total to match the previous layout.
+    hours_cols = [col for col in df.columns if col.startswith('hours_')]
+    totals = pd.Series(np.nansum(df[hours_cols].to_numpy(), axis=1), index=df.index)
+    keep = totals.groupby(df['employee_id'], sort=False).idxmax()
+    keep = keep.iloc[np.argsort(-totals.loc[keep].to_numpy(), kind='stable')]
+    df = df.loc[keep].reset_index(drop=True)
+
+    # Normalize residency case once here so the sidebar filter can compare
+    # category values instead of lowercasing every row per rerun.
+    df['employee_resident'] = df['employee_resident'].str.lower()
+
+    # Low-cardinality strings as categoricals: groupby/isin work on integer
+    # codes and the melted frame repeats codes instead of strings.
+    for col in ('employee_id', 'employee_gender', 'employee_resident', 'employee_department'):
+        df[col] = df[col].astype('category')
+    return df, duplicates
+
+
+def _day_cols(df: pd.DataFrame):
+    return sorted([col for col in df.columns if col.startswith('hours_')], key=lambda x: int(x.split('_')[1]))
+
+
+def _select_days(day_cols, start_date, date_range):
+    """Day columns whose calendar date falls inside the selected range."""
+    start = pd.to_datetime(start_date)
+    lo, hi = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
+    return [
+        col for col in day_cols
+        if lo <= start + pd.Timedelta(days=int(col.split('_')[1]) - 1) <= hi
+    ]
+
+
+def _filter_rows(df: pd.DataFrame, employee, residency, departments) -> pd.DataFrame:
+    # Residency/department are categorical, so the filters compare integer
+    # category codes instead of hashing a Python string per row; the masks
+    # are combined and applied in a single take.
+    mask = np.ones(len(df), dtype=bool)
+    if employee != "All":
+        mask &= (df['employee_id'] == employee).to_numpy()
+    if residency != "All":
+        codes = df['employee_resident'].cat.codes.to_numpy()
+        target = df['employee_resident'].cat.categories.get_indexer([residency.lower()])[0]
+        mask &= (codes == target) if target >= 0 else False
+    if departments:
+        cats = df['employee_department'].cat.categories
+        # One extra slot keeps NaN rows (code -1) excluded via the last entry.
+        allowed = np.zeros(len(cats) + 1, dtype=bool)
+        idx = cats.get_indexer(list(departments))
+        allowed[idx[idx >= 0]] = True
+        mask &= allowed[df['employee_department'].cat.codes.to_numpy()]
+    return df[mask]
+
+
+@st.cache_data
+def reshape(df: pd.DataFrame, start_date, date_range, employee, residency, departments) -> pd.DataFrame:
+    """Melt only the rows and day columns that survive the sidebar filters."""
+    # Restrict the melt to day columns inside the selected date range; the
+    # long frame never materializes days that would be filtered out anyway.
+    selected_day_cols = _select_days(_day_cols(df), start_date, date_range)
+    df = _filter_rows(df, employee, residency, departments)
+
+    df_long = df.melt(
+        id_vars=['employee_id', 'employee_gender', 'employee_resident', 'employee_department'],
+        value_vars=selected_day_cols,
+        var_name='day',
+        value_name='hours_worked'
+    )
+    # hours_* columns are float32 from preprocess, so the melt already
+    # yields a float32 hours_worked column.
+    # Days without recorded hours (weekends, leave) carry nothing any view
+    # needs; dropping them here shrinks every downstream pass.
+    df_long = df_long.dropna(subset=['hours_worked']).reset_index(drop=True)
+    # 'day' only ever holds the melted column names, so a small dict lookup
+    # replaces a per-row regex extract.
+    day_map = {col: int(col.split('_')[1]) for col in selected_day_cols}
+    df_long['day_num'] = df_long['day'].map(day_map).astype('int16')
+    base = np.datetime64(start_date, 'D')
+    df_long['date'] = (
+        base + (df_long['day_num'].to_numpy() - 1).astype('timedelta64[D]')
+    ).astype('datetime64[ns]')
+    df_long['is_punctual'] = df_long['hours_worked'].to_numpy() >= np.float32(8.0)
+    return df_long
+
+
+_CACHE_DIR = os.path.join(os.path.dirname(__file__), '.cache')
+
+
+@st.cache_data
+def load_prepared(file_bytes: bytes, name: str):
+    """Preprocessed frame for the uploaded file, persisted on disk.
+
+    A content-hashed Parquet copy survives app restarts, so re-uploading a
+    previously seen sheet skips the Excel parse, time parsing, and dedup
+    entirely; read-only deploys just fall back to the in-memory cache.
+    """
+    digest = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+    df_path = os.path.join(_CACHE_DIR, f'{digest}.parquet')
+    dup_path = os.path.join(_CACHE_DIR, f'{digest}.dup.parquet')
+    if os.path.exists(df_path) and os.path.exists(dup_path):
+        return pd.read_parquet(df_path), pd.read_parquet(dup_path)
+    df, duplicates = preprocess(load_df(file_bytes, name))
+    try:
+        os.makedirs(_CACHE_DIR, exist_ok=True)
+        df.to_parquet(df_path, compression='zstd')
+        duplicates.to_parquet(dup_path, compression='zstd')
+    except OSError:
+        pass
+    return df, duplicates
+
+
 if file is not None:
-    if file.name.endswith(".csv"):
-        df = pd.read_csv(file)
-    elif file.name.endswith((".xlsx", ".xls")):
-        df = pd.read_excel(file)
-    else:
+    if not file.name.endswith((".csv", ".xlsx", ".xls")):
         st.error("❌ Please upload a valid .csv or Excel file.")
         st.stop()
 else:
     st.warning("📂 Please upload your attendance file to proceed.")
     st.stop()
 
-# --- Calculate hours from In/Out columns ---
-in_cols = [col for col in df.columns if col.startswith('in_')]
-out_cols = [col for col in df.columns if col.startswith('out_')]
-
-for in_col, out_col in zip(in_cols, out_cols):
-    hours_col = in_col.replace('in_', 'hours_')
-    df[hours_col] = (
-        pd.to_datetime(df[out_col], format='%I:%M %p', errors='coerce') -
-        pd.to_datetime(df[in_col], format='%I:%M %p', errors='coerce')
-    ).dt.total_seconds() / 3600
-    df[hours_col] = df[hours_col].round(2)
-
 # =============================
 # 🧹 Clean & Prepare Data
 # =============================
+file_bytes = file.getvalue()
+# Content fingerprint: folded into filter_key so _df-excluded caches can
+# never replay results from a previously uploaded sheet.
+file_digest = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+df, duplicates = load_prepared(file_bytes, file.name)
 
-# --- Handle Duplicates ---
-df.drop_duplicates(inplace=True)
-duplicate_ids = df['employee_id'].value_counts()
-duplicate_ids = duplicate_ids[duplicate_ids > 1]
-
-if not duplicate_ids.empty:
+if not duplicates.empty:
     st.warning("⚠️ Found duplicate entries for these employee IDs:")
-    st.dataframe(df[df['employee_id'].isin(duplicate_ids.index)])
-
-df['total_hours'] = df[[col for col in df.columns if col.startswith('hours_')]].sum(axis=1)
-df = df.sort_values('total_hours', ascending=False).drop_duplicates(subset=['employee_id'], keep='first')
-df.drop(columns='total_hours', inplace=True)
+    st.dataframe(duplicates)
 
 # =============================
-# 🔄 Reshape Data
+# 🎛️ Sidebar Filters
 # =============================
 # 📅 Select Attendance Start Date
 st.sidebar.markdown("### 📅 Select Attendance Start Date")
 start_date_input = st.sidebar.date_input("Start Date", value=pd.to_datetime("2025-06-01"))
-day_cols = sorted([col for col in df.columns if col.startswith('hours_')], key=lambda x: int(x.split('_')[1]))
-df_long = df.melt(
-    id_vars=['employee_id', 'employee_gender', 'employee_resident', 'employee_department'],
-    value_vars=day_cols,
-    var_name='day',
-    value_name='hours_worked'
-)
-df_long['day_num'] = df_long['day'].str.extract(r'(\d+)').astype(int)
-df_long['date'] = pd.to_datetime(start_date_input) + pd.to_timedelta(df_long['day_num'] - 1, unit='D')
-df_long['is_punctual'] = df_long['hours_worked'] >= 8
 
-# =============================
-# 🎛️ Sidebar Filters
-# =============================
 st.sidebar.header("🔍 Filter Options")
 
 # Employee filter
-import re
-
 def sort_emp_id(emp_ids):
     def extract_num(emp_id):
         match = re.search(r'\d+', str(emp_id))
         return int(match.group()) if match else float('inf')
     return sorted(emp_ids, key=extract_num)
 
-employees = sort_emp_id(df_long['employee_id'].dropna().unique())
+employees = sort_emp_id(df['employee_id'].dropna().unique())
 selected_employees = st.sidebar.selectbox("👤 Select Employee", options=["All"] + employees)
 
 # Residency filter
 residency = st.sidebar.selectbox("🏩 Resident Type", options=["All", "Local", "Non-local"])
 
 # Department filter
-departments = sorted(df_long['employee_department'].dropna().unique())
+departments = sorted(df['employee_department'].dropna().unique())
 selected_departments = st.sidebar.multiselect("🏢 Select Department(s)", options=departments, default=departments)
 
 # Extended Date Range filter
 min_date = pd.to_datetime("2020-01-01")
 max_date = pd.to_datetime("2030-12-31")
-default_start = df_long['date'].min()
-default_end = df_long['date'].max()
+n_days = len([col for col in df.columns if col.startswith('hours_')])
+default_start = pd.to_datetime(start_date_input)
+default_end = default_start + pd.Timedelta(days=n_days - 1)
 
 date_range = st.sidebar.date_input(
     "🗓️ Select Date Range",
@@ -195,26 +346,35 @@ date_range = st.sidebar.date_input(
     max_value=max_date
 )
 
-# --- Apply Filters ---
-filtered_df = df_long[
-    (df_long['date'] >= pd.to_datetime(date_range[0])) &
-    (df_long['date'] <= pd.to_datetime(date_range[1]))
-].copy()
-
-if selected_employees != "All":
-    filtered_df = filtered_df[filtered_df['employee_id'] == selected_employees]
-if residency != "All":
-    filtered_df = filtered_df[filtered_df['employee_resident'].str.lower() == residency.lower()]
-if selected_departments:
-    filtered_df = filtered_df[filtered_df['employee_department'].isin(selected_departments)]
+# =============================
+# 🔄 Reshape & Filter Data
+# =============================
+filtered_df = reshape(
+    df, start_date_input,
+    (date_range[0], date_range[1]),
+    selected_employees, residency, tuple(selected_departments)
+)
 
 # =============================
 # 📊 KPIs
 # =============================
-total_employees = filtered_df['employee_id'].nunique()
-total_days = len(filtered_df)
-total_punctual = filtered_df[filtered_df['is_punctual']].shape[0]
-avg_hours = round(filtered_df['hours_worked'].mean(), 2)
+@st.cache_data
+def compute_kpis(df: pd.DataFrame, start_date, date_range, employee, residency, departments):
+    """KPI reductions straight off the wide hours matrix; no melt needed."""
+    selected = _select_days(_day_cols(df), start_date, date_range)
+    rows = _filter_rows(df, employee, residency, departments)
+    sub = rows[selected].to_numpy(dtype=np.float32)
+    total_employees = int(rows['employee_id'].nunique())
+    total_days = int((~np.isnan(sub)).sum())
+    total_punctual = int((sub >= 8).sum())
+    avg_hours = round(float(np.nanmean(sub)), 2) if sub.size else 0.0
+    return total_employees, total_days, total_punctual, avg_hours
+
+
+total_employees, total_days, total_punctual, avg_hours = compute_kpis(
+    df, start_date_input, (date_range[0], date_range[1]),
+    selected_employees, residency, tuple(selected_departments)
+)
 punctuality_rate = round((total_punctual / total_days) * 100, 2) if total_days else 0.0
 
 st.markdown("<h2 style='text-align: center; color: white;'>📊 Key Metrics</h2>", unsafe_allow_html=True)
@@ -225,84 +385,265 @@ kpi3.metric("⏱️ Average Hours Worked", f"{avg_hours} hrs")
 st.markdown("---")
 
 # =============================
-# 🧭 Tabs: Visualization | Summary | Download | Email
+# 🧱 Cached Figure Builders
+# =============================
+# `_df` is excluded from cache hashing (leading underscore); `key` carries the
+# file digest plus filter state, so each (file, filter) combination caches its
+# own figure JSON and tab switches replay it without re-aggregating.
+
+if njit is not None:
+    # No fastmath: its no-NaN assumption would optimize away the v == v guard.
+    @njit(parallel=True)
+    def _row_stats(H):
+        """One fused pass per row: total hours, punctual days, late days.
+
+        Replaces three separate full-matrix scans (nansum + two comparisons)
+        when numba is available; NaN cells (off days) count neither way.
+        """
+        n_rows, n_days = H.shape
+        tot = np.empty(n_rows, dtype=np.float32)
+        pc = np.zeros(n_rows, dtype=np.int64)
+        lc = np.zeros(n_rows, dtype=np.int64)
+        for i in prange(n_rows):
+            s = np.float32(0.0)
+            for j in range(n_days):
+                v = H[i, j]
+                if v == v:  # not NaN
+                    s += v
+                    if v >= 8.0:
+                        pc[i] += 1
+                    else:
+                        lc[i] += 1
+            tot[i] = s
+        return tot, pc, lc
+
+
+@st.cache_data
+def wide_day_stats(df: pd.DataFrame, start_date, date_range, employee, residency, departments):
+    """Per-employee totals straight off the wide hours matrix.
+
+    Rows are unique per employee after dedup, so sums along the day axis
+    replace the melt + groupby the bar/pie/top-5 charts used to need.
+    """
+    selected = _select_days(_day_cols(df), start_date, date_range)
+    rows = _filter_rows(df, employee, residency, departments)
+    H = rows[selected].to_numpy(dtype=np.float32)
+    ids = rows['employee_id'].to_numpy()
+    if njit is not None:
+        total_hours, punctual_days, late_days = _row_stats(np.ascontiguousarray(H))
+        total_hours = np.round(total_hours, 2)
+    else:
+        total_hours = np.round(np.nansum(H, axis=1), 2)
+        punctual_days = (H >= 8).sum(axis=1)
+        late_days = (H < 8).sum(axis=1)  # NaN compares False: off days count neither way
+    return ids, total_hours, punctual_days, late_days
+
+
+def top_k(counts, k=5):
+    k = min(k, len(counts))
+    idx = np.argpartition(counts, -k)[-k:] if k else np.array([], dtype=int)
+    return idx[np.argsort(-counts[idx])]
+
+
+@st.cache_data
+def build_dashboard_fig(_df: pd.DataFrame, key, _wide_stats) -> str:
+    """All eight visualization charts as one 4×2 subplot figure.
+
+    A single figure means one JSON payload and one browser render instead
+    of eight separate trips through Streamlit's message bus.
+    """
+    ids, total_hours, punctual_days, late_days = _wide_stats
+    fig = make_subplots(
+        rows=4, cols=2,
+        specs=[[{}, {}], [{}, {'type': 'domain'}], [{}, {}], [{}, {}]],
+        subplot_titles=(
+            "⏱️ Total Hours Worked per Employee",
+            "⏰ Punctuality Ratio per Employee",
+            "🗓️ Daily Productivity Heatmap",
+            "📈 Overall Punctuality Ratio",
+            "🏘️ Resident Type vs Hours Worked",
+            "🏅 Top 5 Most Punctual Employees",
+            "🚨 Top 5 Late Comers (Hours < 8)",
+            "⚖️ Punctuality vs Late Days Comparison",
+        ),
+        vertical_spacing=0.08
+    )
+
+    # Row 1: total hours + stacked punctual/late counts per employee
+    fig.add_trace(go.Bar(
+        x=ids, y=total_hours,
+        marker=dict(color=total_hours, colorscale='Greens'),
+        showlegend=False
+    ), 1, 1)
+    counts = (
+        _df.groupby(['employee_id', 'is_punctual'], observed=True)
+        .size().unstack(fill_value=0).reindex(columns=[True, False], fill_value=0)
+    )
+    fig.add_trace(go.Bar(x=counts.index.to_numpy(), y=counts[True].to_numpy(),
+                         name='Met (≥8 hrs)'), 1, 2)
+    fig.add_trace(go.Bar(x=counts.index.to_numpy(), y=counts[False].to_numpy(),
+                         name='Not Met (<8 hrs)'), 1, 2)
+
+    # Row 2: productivity heatmap + overall punctuality pie
+    # (employee_id, day_num) pairs are unique after dedup, so a bare unstack
+    # reshapes without pivot_table's groupby-mean machinery; hours stay
+    # float32 from the source column, no extra copy for the trace.
+    heatmap_data = _df.set_index(['employee_id', 'day_num'])['hours_worked'].unstack('day_num')
+    # Cap the matrix at ~400 rows; anything finer than the canvas height
+    # only inflates the payload shipped to the browser.
+    if len(heatmap_data) > 400:
+        bucket = np.arange(len(heatmap_data)) // (len(heatmap_data) // 400 + 1)
+        heatmap_data = heatmap_data.groupby(bucket).mean()
+    fig.add_trace(go.Heatmap(
+        z=heatmap_data.to_numpy(dtype=np.float32, copy=False),
+        x=heatmap_data.columns.to_numpy(), y=heatmap_data.index.to_numpy(),
+        colorscale='YlGnBu', showscale=False
+    ), 2, 1)
+    fig.update_yaxes(autorange='reversed', row=2, col=1)
+    fig.add_trace(go.Pie(
+        labels=['Met ≥8 hrs', 'Not Met <8 hrs'],
+        values=[int(punctual_days.sum()), int(late_days.sum())]
+    ), 2, 2)
+
+    # Row 3: residency box plots + top-5 punctual employees
+    for resident, grp in _df.groupby('employee_resident', observed=True):
+        fig.add_trace(go.Box(y=grp['hours_worked'].to_numpy(), name=str(resident),
+                             showlegend=False), 3, 1)
+    idx = top_k(punctual_days)
+    fig.add_trace(go.Bar(
+        x=ids[idx], y=punctual_days[idx], text=punctual_days[idx],
+        marker_color=px.colors.qualitative.Plotly[:len(idx)], showlegend=False
+    ), 3, 2)
+
+    # Row 4: top-5 late comers + their punctual-vs-late comparison, reusing
+    # the per-employee counts from row 1 instead of a second groupby.
+    idx = top_k(late_days)
+    fig.add_trace(go.Bar(
+        x=ids[idx], y=late_days[idx], text=late_days[idx],
+        marker_color=px.colors.qualitative.Plotly[:len(idx)], showlegend=False
+    ), 4, 1)
+    late_counts = counts.reindex(ids[idx], fill_value=0)
+    # Distinct offsetgroups place these side by side while row 1 stays stacked.
+    fig.add_trace(go.Bar(x=late_counts.index.to_numpy(), y=late_counts[True].to_numpy(),
+                         name='Punctual Days', offsetgroup='punctual'), 4, 2)
+    fig.add_trace(go.Bar(x=late_counts.index.to_numpy(), y=late_counts[False].to_numpy(),
+                         name='Late Days', offsetgroup='late'), 4, 2)
+
+    fig.update_layout(height=1600, barmode='stack')
+    return fig.to_json()
+
+
+# File fingerprint + filter state tuple used as the figure cache key: the
+# digest ties every cached artifact to the uploaded sheet's content, the
+# rest to the sidebar selections.
+filter_key = (
+    file_digest,
+    str(start_date_input), str(date_range[0]), str(date_range[1]),
+    selected_employees, residency, tuple(selected_departments)
+)
+
+# =============================
+# 🧭 Views: Visualization | Summary | Download | Email
 # =============================
-tab1, tab2, tab3, tab4 = st.tabs(["📊 Visualizations", "📋 Summary", "📅 Download", "📬 Email Summary"])
+# A radio instead of st.tabs: tabs execute every tab body on every rerun,
+# the radio runs only the view being looked at.
+active_view = st.radio(
+    "View",
+    ["📊 Visualizations", "📋 Summary", "📅 Download", "📬 Email Summary"],
+    horizontal=True, label_visibility="collapsed"
+)
+
+
+@st.cache_data
+def build_monthly_summary(_df: pd.DataFrame, key) -> pd.DataFrame:
+    """Monthly punctuality summary per employee, shared by download and email."""
+    if duckdb is not None:
+        # DuckDB runs the groupby multithreaded over the frame's buffers.
+        # The frame is already filtered, so no WHERE clause is needed.
+        con = duckdb.connect()
+        con.register('attendance', _df[['employee_id', 'date', 'is_punctual', 'hours_worked']])
+        monthly = con.execute(
+            "SELECT employee_id, strftime(date, '%Y-%m') AS month_year, "
+            "COUNT(*) AS Total_Days, SUM(is_punctual::INT)::INT AS Punctual_Days, "
+            "AVG(hours_worked) AS Avg_Hours_Worked "
+            "FROM attendance GROUP BY 1, 2"
+        ).df()
+        con.close()
+    else:
+        # Month-Year as an integer code (year*12 + month): grouping on int
+        # codes stays on pandas' integer hash path; labels are built after.
+        # assign() shares the existing column arrays instead of deep-copying.
+        month = _df['date'].dt.to_period('M')
+        download_df = _df.assign(month_code=(month.dt.year * 12 + month.dt.month).astype('int32'))
+
+        monthly = download_df.groupby(['employee_id', 'month_code'], observed=True, sort=False).agg(
+            Total_Days=('date', 'count'),
+            Punctual_Days=('is_punctual', 'sum'),
+            Avg_Hours_Worked=('hours_worked', 'mean')
+        ).reset_index()
+        codes = monthly['month_code'].to_numpy()
+        monthly['month_year'] = [f"{(c - 1) // 12}-{(c - 1) % 12 + 1:02d}" for c in codes]
+
+    monthly['Late_Days'] = monthly['Total_Days'] - monthly['Punctual_Days']
+    monthly['Punctuality_Rate'] = (monthly['Punctual_Days'] / monthly['Total_Days'] * 100).round(2)
+    monthly['Avg_Hours_Worked'] = monthly['Avg_Hours_Worked'].round(2)
+    monthly = monthly[[
+        'employee_id', 'month_year', 'Total_Days', 'Punctual_Days',
+        'Late_Days', 'Punctuality_Rate', 'Avg_Hours_Worked'
+    ]]
+
+    # Sort employee_id numerically (T1, T2, ..., T10); IDs without digits sort last
+    monthly['sort_key'] = monthly['employee_id'].astype(str).str.extract(r'(\d+)').astype(float)
+    monthly = monthly.sort_values('sort_key', na_position='last').drop(columns='sort_key')
 
-# --- Tab 1: Visualizations ---
-with tab1:
+    # ➕ Add Punctual_Status column
+    monthly['Punctual_Status'] = np.where(monthly['Punctuality_Rate'] >= 90, "Yes", "No")
+    return monthly
+
+
+@st.cache_data
+def to_csv_bytes(_df: pd.DataFrame, key) -> bytes:
+    """CSV bytes for the download button, built once per filter state."""
+    buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(_df, preserve_index=False), buf)
+    return buf.getvalue()
+
+
+@st.cache_data
+def build_xlsx(_df: pd.DataFrame, key) -> bytes:
+    """Serialize the monthly summary workbook once per filter state."""
+    buf = io.BytesIO()
+    with pd.ExcelWriter(
+        buf, engine='xlsxwriter',
+        engine_kwargs={'options': {
+            'constant_memory': True,
+            'strings_to_formulas': False,
+            'strings_to_urls': False
+        }}
+    ) as writer:
+        _df.to_excel(writer, index=False, sheet_name='Monthly Summary')
+    return buf.getvalue()
+
+
+# --- View: Visualizations ---
+def render_visualizations(filtered_df, filter_key, wide_stats):
     # Centered title
     st.markdown("<h2 style='text-align: center; color: white;'>📊 Employee Attendance Visualizations</h2>", unsafe_allow_html=True)
 
-    row1_col1, row1_col2 = st.columns(2)
-    with row1_col1:
-        st.subheader("⏱️ Total Hours Worked per Employee")
-        fig1 = px.bar(
-            filtered_df.groupby('employee_id')['hours_worked'].sum().reset_index(),
-            x='employee_id', y='hours_worked', color='hours_worked', color_continuous_scale='Greens')
-        st.plotly_chart(fig1, use_container_width=True)
-
-    with row1_col2:
-        st.subheader("⏰ Punctuality Ratio per Employee")
-        punctual_summary = filtered_df.groupby(['employee_id', 'is_punctual']).size().reset_index(name='Count')
-        punctual_summary['Status'] = punctual_summary['is_punctual'].map({True: 'Met (≥8 hrs)', False: 'Not Met (<8 hrs)'})
-        fig2 = px.bar(punctual_summary, x='employee_id', y='Count', color='Status', barmode='stack')
-        st.plotly_chart(fig2, use_container_width=True)
-
-    row2_col1, row2_col2 = st.columns(2)
-    with row2_col1:
-        st.subheader("🗓️ Daily Productivity Heatmap")
-        heatmap_data = filtered_df.pivot_table(index='employee_id', columns='day_num', values='hours_worked')
-        fig3 = px.imshow(heatmap_data.astype(np.float32), aspect="auto", color_continuous_scale='YlGnBu')
-        st.plotly_chart(fig3, use_container_width=True)
-
-    with row2_col2:
-        st.subheader("📈 Overall Punctuality Ratio")
-        overall = filtered_df['is_punctual'].value_counts().rename({True: 'Met ≥8 hrs', False: 'Not Met <8 hrs'})
-        fig4 = px.pie(names=overall.index, values=overall.values)
-        st.plotly_chart(fig4, use_container_width=True)
-
-    row3_col1, row3_col2 = st.columns(2)
-    with row3_col1:
-        st.subheader("🏘️ Resident Type vs Hours Worked")
-        fig5 = px.box(filtered_df, x='employee_resident', y='hours_worked', color='employee_resident')
-        st.plotly_chart(fig5, use_container_width=True)
-
-    with row3_col2:
-        st.subheader("🏅 Top 5 Most Punctual Employees")
-        top5 = filtered_df[filtered_df['is_punctual'] == True]['employee_id'].value_counts().nlargest(5).reset_index()
-        top5.columns = ['Employee ID', 'Punctual Days']
-        fig_top5 = px.bar(top5, x='Employee ID', y='Punctual Days', color='Employee ID', text='Punctual Days')
-        fig_top5.update_layout(showlegend=False)
-        st.plotly_chart(fig_top5, use_container_width=True)
-
-    row4_col1, row4_col2 = st.columns(2)
-    with row4_col1:
-        st.subheader("🚨 Top 5 Late Comers (Hours < 8)")
-        bottom5 = filtered_df[filtered_df['is_punctual'] == False]['employee_id'].value_counts().nlargest(5).reset_index()
-        bottom5.columns = ['Employee ID', 'Late Days']
-        fig_bottom5 = px.bar(bottom5, x='Employee ID', y='Late Days', color='Employee ID', text='Late Days')
-        fig_bottom5.update_layout(showlegend=False)
-        st.plotly_chart(fig_bottom5, use_container_width=True)
-
-    with row4_col2:
-        st.subheader("⚖️ Punctuality vs Late Days Comparison")
-        top_late_ids = bottom5['Employee ID'].tolist()
-        compare_df = filtered_df[filtered_df['employee_id'].isin(top_late_ids)]
-        compare_summary = compare_df.groupby(['employee_id', 'is_punctual']).size().reset_index(name='Count')
-        compare_summary['Status'] = compare_summary['is_punctual'].map({True: 'Punctual Days', False: 'Late Days'})
-        fig_compare = px.bar(compare_summary, x='employee_id', y='Count', color='Status', barmode='group')
-        st.plotly_chart(fig_compare, use_container_width=True)
-
-# --- Tab 2: Summary ---
-with tab2:
+    st.plotly_chart(
+        pio.from_json(build_dashboard_fig(filtered_df, filter_key, wide_stats)),
+        use_container_width=True
+    )
+
+# --- View: Summary ---
+def render_summary(filtered_df):
     st.subheader("📄 Executive Summary")
 
     # Core Metrics
     total_employees = filtered_df['employee_id'].nunique()
     total_days = filtered_df['date'].nunique()
     total_records = len(filtered_df)
-    total_punctual = filtered_df[filtered_df['is_punctual']].shape[0]
+    total_punctual = int(filtered_df['is_punctual'].to_numpy().sum())
     avg_hours_worked = round(filtered_df['hours_worked'].mean(), 2)
     punctuality_rate = round((total_punctual / total_records) * 100, 2) if total_records else 0.0
 
@@ -324,38 +665,18 @@ with tab2:
 
     st.success("This detailed summary provides a managerial view of employee attendance patterns, average productivity, and organizational discipline levels.")
 
-# --- Tab 3: Download ---
-with tab3:
+# --- View: Download ---
+def render_download(filtered_df, filter_key, start_date_input):
     st.subheader("📥 Download Processed Data")
 
     # 📌 Display Month-Year from selected start date
     month_label = pd.to_datetime(start_date_input).strftime("%B %Y")
     st.markdown(f"### 🗓️ Download Monthly Punctuality Summary for **{month_label}**")
 
-    # Add Month-Year column
-    download_df = filtered_df.copy()
-    download_df['month_year'] = download_df['date'].dt.to_period('M').astype(str)
-
-    # Monthly Summary (Sorted Employee IDs)
-    monthly_summary_df = download_df.groupby(['employee_id', 'month_year']).agg(
-        Total_Days=('date', 'count'),
-        Punctual_Days=('is_punctual', 'sum'),
-        Late_Days=('is_punctual', lambda x: (~x).sum()),
-        Punctuality_Rate=('is_punctual', lambda x: round(x.mean() * 100, 2)),
-        Avg_Hours_Worked=('hours_worked', lambda x: round(x.mean(), 2))
-    ).reset_index()
-
-    # Sort employee_id numerically (T1, T2, ..., T10)
-    monthly_summary_df['sort_key'] = monthly_summary_df['employee_id'].str.extract('(\d+)').astype(int)
-    monthly_summary_df = monthly_summary_df.sort_values('sort_key').drop(columns='sort_key')
+    monthly_summary_df = build_monthly_summary(filtered_df, filter_key)
 
-    # ➕ Add Punctual_Status column
-    monthly_summary_df['Punctual_Status'] = monthly_summary_df['Punctuality_Rate'].apply(
-        lambda x: "Yes" if x >= 90 else "No"
-    )
-
-    # Provide CSV download
-    csv_data = monthly_summary_df.to_csv(index=False).encode('utf-8')
+    # Provide CSV download (Arrow's writer formats straight into the buffer)
+    csv_data = to_csv_bytes(monthly_summary_df, filter_key)
     st.download_button(
         label="📄 Download Monthly Summary CSV",
         data=csv_data,
@@ -363,69 +684,83 @@ with tab3:
         mime='text/csv'
     )
 
-# --- Tab 4: Email Summary ---
-with tab4:
+    # Same cached workbook bytes the email view attaches — built at most once
+    # per filter state no matter which path asks first.
+    xlsx_data = build_xlsx(monthly_summary_df, filter_key)
+    st.download_button(
+        label="📊 Download Monthly Summary Excel",
+        data=xlsx_data,
+        file_name=f'monthly_punctuality_summary_{month_label.replace(" ", "_")}.xlsx',
+        mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    )
+
+def _send_email(sender, password, recipient, attachment: bytes):
+    """Build and send the summary email; runs on a worker thread."""
+    msg = EmailMessage()
+    msg['Subject'] = "Employee Attendance Summary"
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg.set_content(
+        "Hi,\n\nPlease find attached the daily and monthly employee attendance summary.\n\nRegards,\nDashboard System")
+    msg.add_attachment(
+        attachment,
+        maintype='application',
+        subtype='vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        filename='EmployeeAttendanceSummary.xlsx'
+    )
+    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
+        smtp.login(sender, password)
+        smtp.send_message(msg)
+
+
+# --- View: Email Summary ---
+def render_email(filtered_df, filter_key):
     st.subheader("📬 Email Summary to Manager")
     sender_email = st.text_input("📧 Enter your Gmail address")
     sender_password = st.text_input("🔐 Enter App Password", type="password")
     recipient_email = st.text_input("📨 Enter Manager's Email")
     send_email = st.button("📧 Send Summary")
 
+    # The SMTP handshake and upload run on a pooled thread so the script
+    # returns immediately; the future is polled on subsequent reruns.
+    executor = st.session_state.setdefault('email_executor', ThreadPoolExecutor(max_workers=2))
+    future = st.session_state.get('email_future')
+
     if send_email and sender_email and sender_password and recipient_email:
-        with st.spinner("📤 Sending email..."):
+        attachment = build_xlsx(build_monthly_summary(filtered_df, filter_key), filter_key)
+        st.session_state['email_future'] = executor.submit(
+            _send_email, sender_email, sender_password, recipient_email, attachment
+        )
+        st.info("📤 Sending email in the background — you can keep using the dashboard.")
+    elif send_email:
+        st.warning("⚠️ Please enter all email credentials correctly.")
+    elif future is not None:
+        if future.done():
             try:
-                msg = EmailMessage()
-                msg['Subject'] = "Employee Attendance Summary"
-                msg['From'] = sender_email
-                msg['To'] = recipient_email
-                msg.set_content(
-                    "Hi,\n\nPlease find attached the daily and monthly employee attendance summary.\n\nRegards,\nDashboard System")
-
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    monthly_summary_df.to_excel(writer, index=False, sheet_name='Monthly Summary')
-                output.seek(0)
-                msg.add_attachment(
-                    output.read(),
-                    maintype='application',
-                    subtype='vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    filename='EmployeeAttendanceSummary.xlsx'
-                )
-
-                with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-                    smtp.login(sender_email, sender_password)
-                    smtp.send_message(msg)
-
+                future.result()
                 st.success("✉️ Email sent successfully!")
             except Exception as e:
                 st.error(f"❌ Something went wrong: {e}")
-    elif send_email:
-        st.warning("⚠️ Please enter all email credentials correctly.")
+            del st.session_state['email_future']
+        else:
+            st.info("📤 Email still sending...")
+
+
+if active_view == "📊 Visualizations":
+    wide_stats = wide_day_stats(
+        df, start_date_input, (date_range[0], date_range[1]),
+        selected_employees, residency, tuple(selected_departments)
+    )
+    render_visualizations(filtered_df, filter_key, wide_stats)
+elif active_view == "📋 Summary":
+    render_summary(filtered_df)
+elif active_view == "📅 Download":
+    render_download(filtered_df, filter_key, start_date_input)
+else:
+    render_email(filtered_df, filter_key)
 
 # =============================
 # 📎 Footer
 # =============================
 st.markdown("---")
 st.markdown("© 2025 Diverse Infotech Pvt Ltd | Built by AYRS")
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-